@@ -0,0 +1,62 @@
+"""
+artifacts.py — Parsed-document artifacts kept alongside stored uploads.
+
+After a document's first analysis we keep its parsed text (split into sections, which
+doubles as the section index), extracted metrics and the verifier's result in the blob
+store next to the document itself, so follow-up queries skip parsing and verification.
+"""
+
+import json
+import logging
+
+from compaction import split_sections, extract_metrics
+from pdf_parser import parse_pdf
+from storage import get_store, artifact_key
+
+logger = logging.getLogger(__name__)
+
+
+def load_artifacts(document_sha256: str):
+    """Stored artifacts for a document, or None if it has not been processed yet."""
+    store = get_store()
+    key = artifact_key(document_sha256)
+    if not store.exists(key):
+        return None
+    return json.loads(store.get(key))
+
+
+def save_artifacts(document_sha256: str, artifacts: dict):
+    get_store().put(artifact_key(document_sha256), json.dumps(artifacts).encode("utf-8"))
+
+
+def build_artifacts(file_path: str) -> dict:
+    text = parse_pdf(file_path)
+    return {
+        "sections": [[title, body] for title, body in split_sections(text)],
+        "metrics": extract_metrics(text),
+        "verification": None,
+    }
+
+
+def ensure_artifacts(document_sha256: str, file_path: str) -> dict:
+    """Load the document's artifacts, parsing `file_path` and storing them if missing."""
+    artifacts = load_artifacts(document_sha256)
+    if artifacts is None:
+        artifacts = build_artifacts(file_path)
+        save_artifacts(document_sha256, artifacts)
+    return artifacts
+
+
+def save_run_artifacts(document_sha256: str, file_path: str, crew_output):
+    """
+    Persist artifacts after a full pipeline run, including the verification task's output.
+    Best effort: a failure here must not fail the analysis that already succeeded.
+    """
+    try:
+        artifacts = ensure_artifacts(document_sha256, file_path)
+        tasks_output = getattr(crew_output, "tasks_output", None) or []
+        if tasks_output:
+            artifacts["verification"] = tasks_output[0].raw
+            save_artifacts(document_sha256, artifacts)
+    except Exception:
+        logger.exception("Could not save artifacts for document %s", document_sha256)
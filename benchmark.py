@@ -0,0 +1,615 @@
+"""
+benchmark.py — Offline benchmark harness for the full analysis pipeline.
+
+Generates synthetic financial PDFs (or loads a recorded workload), replays the
+requests against /analyze and /analyze/async in-process, and reports throughput,
+p50/p95/p99 latency, peak RSS and per-stage time as JSON.
+
+No network access is needed: the CrewAI crew is replaced by a deterministic fake
+LLM, Celery runs eagerly on an in-memory broker and the database is a throwaway
+SQLite file. Document parsing and everything around the crew run for real.
+
+Run with:
+    python benchmark.py --pages 10 100 500 2000 --repeat 3 --output bench_results.json
+    python benchmark.py --workload recorded.jsonl --compare bench_baseline.json
+    python benchmark.py --endpoints /analyze "/jobs/{job_id}/query" --pages 500
+    python benchmark.py --parse-only --pages 100 500 1500 --workers 1 2 4 8
+
+Workload files are JSONL, one request per line:
+    {"endpoint": "/analyze", "query": "Focus on cash flow", "pages": 200}
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import resource
+import datetime
+from collections import defaultdict
+from types import SimpleNamespace
+
+DEFAULT_PAGES = [10, 100, 500, 2000]
+DEFAULT_ENDPOINTS = ["/analyze", "/analyze/async"]
+# Follow-up query on a freshly analyzed document; only the follow-up is timed
+REQUERY_ENDPOINT = "/jobs/{job_id}/query"
+ALL_ENDPOINTS = DEFAULT_ENDPOINTS + [REQUERY_ENDPOINT]
+DEFAULT_QUERY = "Analyze this financial document for investment insights"
+
+
+# ── SYNTHETIC DOCUMENTS ───────────────────────────────────────────────────────
+
+_SECTIONS = [
+    "Consolidated Statements of Operations",
+    "Consolidated Balance Sheets",
+    "Consolidated Statements of Cash Flows",
+    "Management's Discussion and Analysis",
+    "Risk Factors",
+    "Liquidity and Capital Resources",
+    "Outlook and Guidance",
+]
+
+_LINE_ITEMS = [
+    "Total revenues", "Cost of revenues", "Gross profit", "Operating expenses",
+    "Research and development", "Income from operations", "Net income",
+    "Diluted EPS", "Cash and cash equivalents", "Total liabilities",
+    "Net cash provided by operating activities", "Capital expenditures",
+    "Free cash flow", "Long-term debt",
+]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_lines(rng: random.Random, page_no: int) -> list:
+    """Deterministic, financial-looking text for one page."""
+    section = _SECTIONS[page_no % len(_SECTIONS)]
+    lines = [f"Acme Motors Inc. - Q2 2025 Update - Page {page_no + 1}", section]
+    for _ in range(28):
+        item = rng.choice(_LINE_ITEMS)
+        current = rng.randint(100, 25000)
+        prior = max(1, int(current * rng.uniform(0.7, 1.3)))
+        change = (current - prior) / prior * 100
+        lines.append(f"{item}: ${current:,}M vs ${prior:,}M prior year ({change:+.1f}% YoY)")
+    return lines
+
+
+def generate_pdf(path: str, pages: int, seed: int = 0) -> str:
+    """
+    Write a synthetic multi-page financial PDF to `path`.
+    Pure Python (no reportlab) so the harness runs with the base requirements.
+    """
+    rng = random.Random(seed)
+    # Object layout: 1 catalog, 2 pages tree, 3 font, then (page, content) pairs
+    objects = {}
+    kids = []
+    for i in range(pages):
+        page_id, content_id = 4 + 2 * i, 5 + 2 * i
+        kids.append(f"{page_id} 0 R")
+        ops = ["BT", "/F1 9 Tf", "12 TL", "50 760 Td"]
+        for line in _page_lines(rng, i):
+            ops.append(f"({_pdf_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + objects[obj_id] + b"\nendobj\n"
+    xref_at = len(out)
+    count = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % count
+    for obj_id in range(1, count):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref_at)
+
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+# ── FAKE LLM / CREW ───────────────────────────────────────────────────────────
+
+class StageTimer:
+    """Thread-safe accumulator of per-stage wall time across all requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.paused = False
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            if self.paused:
+                return
+            self.totals[stage] += seconds
+            self.counts[stage] += 1
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+            self.counts.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: (self.totals[stage], self.counts[stage]) for stage in self.totals}
+
+
+STAGES = StageTimer()
+
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the real LLM.
+    Output depends only on the prompt; latency is a fixed cost plus a per-token cost,
+    so prompt size shows up in the numbers the same way it does with a hosted model.
+    """
+
+    def __init__(self, base_latency_ms: float = 0.0, per_1k_tokens_ms: float = 0.0):
+        self.base_latency_ms = base_latency_ms
+        self.per_1k_tokens_ms = per_1k_tokens_ms
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return len(text) // 4
+
+    def complete(self, prompt: str, title: str) -> str:
+        tokens = self.count_tokens(prompt)
+        delay = (self.base_latency_ms + self.per_1k_tokens_ms * tokens / 1000) / 1000
+        if delay > 0:
+            time.sleep(delay)
+        digest = hashlib.sha256(prompt.encode("utf-8", "ignore")).hexdigest()[:16]
+        return f"## {title}\nPrompt tokens: {tokens}\nDigest: {digest}\n"
+
+
+class FakeCrewOutput:
+    """Mimics crewai's CrewOutput: str() is the final report, tasks_output holds every task's."""
+
+    def __init__(self, outputs: list):
+        self.tasks_output = [SimpleNamespace(raw=output) for output in outputs]
+        self.raw = outputs[-1] if outputs else ""
+
+    def __str__(self):
+        return self.raw
+
+
+def make_fake_crew(llm: FakeLLM):
+    """Build a drop-in replacement for crewai.Crew that drives `llm` instead of a real model."""
+
+    class FakeCrew:
+        def __init__(self, agents=None, tasks=None, process=None, verbose=False, **kwargs):
+            self.tasks = tasks or []
+
+        def kickoff(self, inputs=None):
+            inputs = inputs or {}
+            query = inputs.get("query", "")
+            path = query.rsplit("Document file path:", 1)[-1].strip() if "Document file path:" in query else None
+            outputs = []
+            output_by_task = {}
+            for task in self.tasks:
+                description = task.description
+                for key, value in inputs.items():
+                    description = description.replace("{" + key + "}", str(value))
+                prompt_parts = [description]
+
+                # Run every document tool the task is wired to, exactly as an agent would
+                for tool in task.tools or []:
+                    schema = getattr(tool, "args_schema", None)
+                    fields = getattr(schema, "model_fields", {}) if schema else {}
+                    if "path" not in fields or path is None:
+                        continue
+                    kwargs = {"path": path}
+                    if "query" in fields:
+                        kwargs["query"] = query
+                    start = time.perf_counter()
+                    prompt_parts.append(str(tool.run(**kwargs)))
+                    STAGES.add("parse", time.perf_counter() - start)
+
+                # Same as crewai's sequential process: explicit context tasks only,
+                # otherwise every prior task's output
+                if isinstance(task.context, list):
+                    prompt_parts.extend(
+                        output_by_task[id(t)] for t in task.context if id(t) in output_by_task
+                    )
+                else:
+                    prompt_parts.extend(outputs)
+                start = time.perf_counter()
+                output = llm.complete("\n\n".join(prompt_parts), title=task.agent.role)
+                STAGES.add("llm", time.perf_counter() - start)
+
+                guardrail = getattr(task, "guardrail", None)
+                if callable(guardrail):
+                    start = time.perf_counter()
+                    _, output = guardrail(SimpleNamespace(raw=output))
+                    STAGES.add("compaction", time.perf_counter() - start)
+                outputs.append(output)
+                output_by_task[id(task)] = output
+            return FakeCrewOutput(outputs)
+
+    return FakeCrew
+
+
+# ── HARNESS ───────────────────────────────────────────────────────────────────
+
+def _install_fakes(llm: FakeLLM, workdir: str):
+    """
+    Point the app at a throwaway database, an in-memory Celery broker and the fake crew.
+    Must run before main/worker/database are imported.
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["STORAGE_ROOT"] = os.path.join(workdir, "blobs")
+    os.environ["STORAGE_GC_INTERVAL"] = "0"
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-offline")
+    os.environ.setdefault("SERPER_API_KEY", "benchmark-offline")
+
+    import crewai
+    import main
+    from worker import celery_app
+
+    celery_app.conf.update(
+        broker_url="memory://",
+        result_backend="cache+memory://",
+        task_always_eager=True,
+        task_eager_propagates=False,
+    )
+
+    fake_crew = make_fake_crew(llm)
+    crewai.Crew = fake_crew   # worker.run_crew_task imports Crew at call time
+    main.Crew = fake_crew
+    return main
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _peak_rss_mb() -> float:
+    """
+    Process-lifetime RSS high-water mark (self and reaped children). Cumulative: it never
+    goes down, so it is only reported once, for the whole run.
+    """
+    # ru_maxrss is KiB on Linux and bytes on macOS; include children for process pools
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return round(usage / scale, 1)
+
+
+def _current_rss_bytes(pid="self"):
+    """Resident set size of `pid` plus its live child processes, from /proc (Linux only)."""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    with open(f"/proc/{pid}/statm") as f:
+        total += int(f.read().split()[1]) * page_size
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children = f.read().split()
+        except OSError:
+            continue
+        for child in children:
+            try:
+                total += _current_rss_bytes(child)
+            except OSError:
+                pass  # child exited between listing and reading
+    return total
+
+
+class RssSampler:
+    """
+    Background sampler of current RSS, so each benchmark group reports its own peak
+    rather than the process-lifetime high-water mark. Unsupported platforms report None.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.supported = os.path.exists("/proc/self/statm")
+        self._peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.supported:
+            self._peak = _current_rss_bytes()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._peak = max(self._peak, _current_rss_bytes())
+            except OSError:
+                pass
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._peak = max(self._peak, _current_rss_bytes())
+
+    @property
+    def peak_mb(self):
+        return round(self._peak / (1024 * 1024), 1) if self.supported else None
+
+
+def load_workload(path: str) -> list:
+    workload = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            workload.append({
+                "endpoint": entry.get("endpoint", "/analyze"),
+                "query": entry.get("query") or DEFAULT_QUERY,
+                "pages": int(entry.get("pages", 10)),
+            })
+    return workload
+
+
+def synthetic_workload(pages: list, endpoints: list, repeat: int) -> list:
+    return [
+        {"endpoint": endpoint, "query": DEFAULT_QUERY, "pages": n}
+        for n in pages
+        for endpoint in endpoints
+        for _ in range(repeat)
+    ]
+
+
+def _send(client, request: dict, pdf_path: str) -> float:
+    """Send one request and wait until the analysis is available. Returns latency in seconds."""
+    with open(pdf_path, "rb") as f:
+        # Unique trailing comment per request: uploads are content-addressed, and identical
+        # bytes would otherwise be served from the parse cache instead of being parsed
+        content = f.read() + f"\n% bench-{time.perf_counter_ns()}\n".encode()
+    if request["endpoint"] == REQUERY_ENDPOINT:
+        # Untimed first analysis so the follow-up has a job and stored artifacts to reuse
+        STAGES.paused = True
+        try:
+            first = client.post(
+                "/analyze",
+                files={"file": (os.path.basename(pdf_path), content, "application/pdf")},
+                data={"query": DEFAULT_QUERY},
+            )
+        finally:
+            STAGES.paused = False
+        first.raise_for_status()
+        start = time.perf_counter()
+        response = client.post(
+            REQUERY_ENDPOINT.format(job_id=first.json()["job_id"]),
+            data={"query": request["query"]},
+        )
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = client.post(
+        request["endpoint"],
+        files={"file": (os.path.basename(pdf_path), content, "application/pdf")},
+        data={"query": request["query"]},
+    )
+    response.raise_for_status()
+    if request["endpoint"] == "/analyze/async":
+        poll_url = response.json()["poll_url"]
+        while True:
+            job = client.get(poll_url).json()
+            if job["status"] in ("completed", "failed"):
+                if job["status"] == "failed":
+                    raise RuntimeError(f"Job {job['job_id']} failed")
+                break
+            time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def run_benchmark(workload: list, llm: FakeLLM, seed: int = 0) -> dict:
+    from fastapi.testclient import TestClient
+
+    workdir = tempfile.mkdtemp(prefix="fda-bench-")
+    main = _install_fakes(llm, workdir)
+
+    documents = {}
+    for n in sorted({r["pages"] for r in workload}):
+        documents[n] = generate_pdf(os.path.join(workdir, f"synthetic_{n}p.pdf"), n, seed=seed)
+
+    groups = defaultdict(list)
+    for request in workload:
+        groups[(request["endpoint"], request["pages"])].append(request)
+
+    results = []
+    with TestClient(main.app) as client:
+        # Warm-up so import and DB creation costs are not charged to the first group
+        _send(client, {"endpoint": "/analyze", "query": DEFAULT_QUERY, "pages": 1},
+              documents[min(documents)])
+
+        for (endpoint, pages), requests in groups.items():
+            STAGES.reset()
+            latencies = []
+            with RssSampler() as rss:
+                group_start = time.perf_counter()
+                for request in requests:
+                    latencies.append(_send(client, request, documents[pages]))
+                elapsed = time.perf_counter() - group_start
+
+            stages = {}
+            crew_total = 0.0
+            for stage, (total, count) in STAGES.snapshot().items():
+                crew_total += total
+                stages[stage] = {
+                    "total_ms": round(total * 1000, 2),
+                    "per_request_ms": round(total * 1000 / len(requests), 2),
+                    "calls": count,
+                }
+            overhead = sum(latencies) - crew_total
+            stages["api_overhead"] = {
+                "total_ms": round(overhead * 1000, 2),
+                "per_request_ms": round(overhead * 1000 / len(requests), 2),
+                "calls": len(requests),
+            }
+
+            results.append({
+                "endpoint": endpoint,
+                "pages": pages,
+                "requests": len(requests),
+                "throughput_rps": round(len(requests) / elapsed, 3) if elapsed else 0.0,
+                "latency_ms": {
+                    "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+                    "p50": round(_percentile(latencies, 50) * 1000, 2),
+                    "p95": round(_percentile(latencies, 95) * 1000, 2),
+                    "p99": round(_percentile(latencies, 99) * 1000, 2),
+                },
+                "stages": stages,
+                # Sampled during this group only (self + live children)
+                "peak_rss_mb": rss.peak_mb,
+            })
+            print(
+                f"{endpoint:<16} {pages:>5}p  n={len(requests):<3} "
+                f"p50={results[-1]['latency_ms']['p50']:>9.1f}ms  "
+                f"p95={results[-1]['latency_ms']['p95']:>9.1f}ms  "
+                f"rss={results[-1]['peak_rss_mb']}MB"
+            )
+
+    return {
+        "meta": {
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "llm_base_latency_ms": llm.base_latency_ms,
+            "llm_per_1k_tokens_ms": llm.per_1k_tokens_ms,
+        },
+        # Whole-run high-water mark; per-group peaks are in results[*].peak_rss_mb
+        "peak_rss_mb": _peak_rss_mb(),
+        "results": results,
+    }
+
+
+def run_parse_benchmark(pages: list, workers: list, repeat: int = 3, seed: int = 0) -> dict:
+    """Pages/sec of pdf_parser.parse_pages against document size and worker count."""
+    from pdf_parser import parse_pages
+
+    workdir = tempfile.mkdtemp(prefix="fda-bench-parse-")
+    results = []
+    for n in pages:
+        path = generate_pdf(os.path.join(workdir, f"synthetic_{n}p.pdf"), n, seed=seed)
+        for w in workers:
+            parse_pages(path, workers=w, min_pages=0)  # warm up the process pool
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parse_pages(path, workers=w, min_pages=0)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            results.append({
+                "pages": n,
+                "workers": w,
+                "seconds_p50": round(_percentile(timings, 50), 4),
+                "seconds_best": round(best, 4),
+                "pages_per_sec": round(n / best, 1) if best else 0.0,
+            })
+            print(f"parse {n:>5}p  workers={w:<2}  {results[-1]['pages_per_sec']:>9.1f} pages/s")
+
+    return {
+        "meta": {
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+        },
+        "peak_rss_mb": _peak_rss_mb(),
+        "parse_results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every group whose p95 regressed by more than `tolerance` (0.2 = 20%)."""
+    previous = {(r["endpoint"], r["pages"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        base = previous.get((result["endpoint"], result["pages"]))
+        if not base or not base["latency_ms"]["p95"]:
+            continue
+        ratio = result["latency_ms"]["p95"] / base["latency_ms"]["p95"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{result['endpoint']} {result['pages']}p: p95 "
+                f"{base['latency_ms']['p95']}ms -> {result['latency_ms']['p95']}ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the financial analysis pipeline")
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES,
+                        help="Synthetic document sizes in pages")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS, choices=ALL_ENDPOINTS)
+    parser.add_argument("--repeat", type=int, default=3, help="Requests per (endpoint, size) group")
+    parser.add_argument("--workload", help="JSONL workload to replay instead of the synthetic matrix")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Fixed fake LLM latency per call")
+    parser.add_argument("--llm-ms-per-1k-tokens", type=float, default=0.0, help="Fake LLM latency per 1k prompt tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="Baseline results JSON; exit non-zero on p95 regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown vs baseline")
+    parser.add_argument("--parse-only", action="store_true",
+                        help="Benchmark PDF parsing throughput (pages/sec) instead of the API")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Parser worker counts to compare with --parse-only")
+    args = parser.parse_args(argv)
+
+    if args.parse_only:
+        report = run_parse_benchmark(args.pages, args.workers, repeat=args.repeat, seed=args.seed)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+        return 0
+
+    workload = (
+        load_workload(args.workload) if args.workload
+        else synthetic_workload(args.pages, args.endpoints, args.repeat)
+    )
+    llm = FakeLLM(args.llm_latency_ms, args.llm_ms_per_1k_tokens)
+    report = run_benchmark(workload, llm, seed=args.seed)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,249 @@
+"""
+compaction.py — Token-budget-aware context compaction between chained tasks.
+
+Downstream tasks (investment_analysis, risk_assessment) used to receive the raw
+document plus every prior report, and verification/analysis read the whole filing. This module turns a parsed document into a
+structured digest (section index, extracted metrics, query-relevant excerpts) and
+trims prior task outputs, both capped at a per-task token budget so prompt size
+stays bounded regardless of filing length.
+"""
+
+import os
+import re
+from collections import Counter
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a ~4 chars/token estimate
+    _ENCODING = None
+
+# Per-task prompt budgets (tokens), overridable via env vars
+TASK_TOKEN_BUDGETS = {
+    # Verification and analysis: the Financial Document Reader digests documents above this
+    "general": int(os.getenv("TOKEN_BUDGET_GENERAL", "6000")),
+    "investment": int(os.getenv("TOKEN_BUDGET_INVESTMENT", "6000")),
+    "risk": int(os.getenv("TOKEN_BUDGET_RISK", "6000")),
+    # Budget for a prior task's report when it is passed on through `context=`
+    "context": int(os.getenv("TOKEN_BUDGET_CONTEXT", "2500")),
+}
+
+# Terms that make a section relevant to each task, on top of the user's query
+FOCUS_KEYWORDS = {
+    "general": ["revenue", "income", "margin", "cash", "guidance", "outlook", "eps"],
+    "investment": [
+        "growth", "revenue", "margin", "guidance", "outlook", "market", "demand",
+        "backlog", "capital", "expansion", "product", "valuation", "eps",
+    ],
+    "risk": [
+        "risk", "uncertain", "debt", "liquidity", "leverage", "covenant", "litigation",
+        "regulatory", "currency", "supply", "competition", "impairment", "decline",
+    ],
+}
+
+# Metric name -> pattern matched against individual lines of the document
+METRIC_PATTERNS = {
+    "revenue": re.compile(r"\b(total\s+)?revenues?\b", re.I),
+    "gross_profit": re.compile(r"\bgross\s+(profit|margin)\b", re.I),
+    "operating_income": re.compile(r"\b(operating\s+income|income\s+from\s+operations)\b", re.I),
+    "net_income": re.compile(r"\bnet\s+(income|loss)\b", re.I),
+    "eps": re.compile(r"\b(eps|earnings\s+per\s+share)\b", re.I),
+    "operating_cash_flow": re.compile(r"\b(operating\s+cash\s+flow|cash\s+provided\s+by\s+operating)\b", re.I),
+    "free_cash_flow": re.compile(r"\bfree\s+cash\s+flow\b", re.I),
+    "capex": re.compile(r"\bcapital\s+expenditures?\b", re.I),
+    "cash": re.compile(r"\bcash\s+(and\s+cash\s+equivalents|and\s+investments)\b", re.I),
+    "debt": re.compile(r"\b(long-term\s+debt|total\s+debt|borrowings)\b", re.I),
+    "guidance": re.compile(r"\b(guidance|outlook|expects?\s+to)\b", re.I),
+}
+
+_NUMBER = re.compile(r"[$€£]?\(?-?\d[\d,]*\.?\d*\)?\s*(%|[MBK]\b|million|billion)?", re.I)
+_WORD = re.compile(r"[a-z][a-z\-]{2,}")
+_MAX_METRIC_LINES = 3
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when available, otherwise a chars/4 estimate."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+_TRUNCATION_MARKER = "[... truncated to fit token budget ...]"
+
+
+def _cut_line(line: str, budget: int) -> str:
+    """Longest prefix of a single line that fits in `budget` tokens."""
+    if budget <= 0:
+        return ""
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(line, disallowed_special=())[:budget])
+    return line[:max(0, (budget - 1) * 4)]
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """
+    Cut `text` so it fits in `budget` tokens. Cuts on a line boundary where possible;
+    a line that does not fit on its own is cut inside the line rather than dropped.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    marker_cost = count_tokens(_TRUNCATION_MARKER + "\n")
+    if budget < 2 * marker_cost:
+        # Too small to spend on the marker; cut the text alone
+        return _cut_line(text, budget)
+    budget -= marker_cost
+    kept, used = [], 0
+    for line in text.splitlines():
+        cost = count_tokens(line + "\n")
+        if used + cost > budget:
+            partial = _cut_line(line, budget - used - 1)
+            if partial:
+                kept.append(partial)
+            break
+        kept.append(line)
+        used += cost
+    kept.append(_TRUNCATION_MARKER)
+    return "\n".join(kept)
+
+
+def _is_heading(line: str) -> bool:
+    stripped = line.strip()
+    if not 3 <= len(stripped) <= 80 or stripped.endswith((".", ",", ";", ":")):
+        return False
+    if stripped.startswith("#"):
+        return True
+    words = stripped.split()
+    if len(words) > 10 or sum(ch.isdigit() for ch in stripped) > 4:
+        return False
+    return stripped.isupper() or all(w[0].isupper() for w in words if w[0].isalpha() and len(w) > 3)
+
+
+def split_sections(text: str) -> list:
+    """Split a document into [(title, body)] using heading-like lines as boundaries."""
+    sections = []
+    title, body = "Preamble", []
+    for line in text.splitlines():
+        if _is_heading(line):
+            if body:
+                sections.append((title, "\n".join(body)))
+            title, body = line.strip().lstrip("#").strip(), []
+        elif line.strip():
+            body.append(line.strip())
+    if body:
+        sections.append((title, "\n".join(body)))
+    return sections
+
+
+def extract_metrics(text: str) -> dict:
+    """Map each known metric to the first few document lines that state a figure for it."""
+    metrics = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or len(line) > 300 or not _NUMBER.search(line):
+            continue
+        for name, pattern in METRIC_PATTERNS.items():
+            found = metrics.setdefault(name, [])
+            if len(found) < _MAX_METRIC_LINES and pattern.search(line) and line not in found:
+                found.append(line)
+    return {name: lines for name, lines in metrics.items() if lines}
+
+
+def rank_sections(sections: list, query: str, focus: str = "general") -> list:
+    """Order sections by how often they mention query and focus keywords."""
+    keywords = Counter(w for w in _WORD.findall(query.lower()) if len(w) > 3)
+    for word in FOCUS_KEYWORDS.get(focus, FOCUS_KEYWORDS["general"]):
+        keywords[word] += 1
+
+    scored = []
+    for index, (title, body) in enumerate(sections):
+        haystack = f"{title}\n{body}".lower()
+        score = sum(weight * haystack.count(word) for word, weight in keywords.items())
+        # Normalise by length so one huge section does not win on size alone
+        scored.append((score / (1 + len(haystack) / 2000), -index, title, body))
+    scored.sort(reverse=True)
+    return [(title, body) for score, _, title, body in scored if score > 0]
+
+
+def build_digest(text: str, query: str = "", focus: str = "general", budget: int = None) -> str:
+    """
+    Structured, budget-capped digest of a parsed document:
+    section index, extracted metrics, then the most relevant section excerpts.
+    """
+    return digest_from_sections(split_sections(text), extract_metrics(text), query, focus, budget)
+
+
+def digest_from_sections(sections: list, metrics: dict, query: str = "", focus: str = "general",
+                         budget: int = None) -> str:
+    """build_digest() for a document whose sections and metrics were extracted earlier."""
+    budget = budget or TASK_TOKEN_BUDGETS.get(focus, TASK_TOKEN_BUDGETS["general"])
+    source_tokens = sum(count_tokens(body) for _, body in sections)
+
+    parts = [f"# Document Digest (focus: {focus}, ~{source_tokens} tokens in source)"]
+    titles = list(dict.fromkeys(title for title, _ in sections))
+    parts.append("## Section Index\n" + "\n".join(f"- {t}" for t in titles[:40]))
+    if metrics:
+        lines = ["## Extracted Metrics"]
+        for name, found in metrics.items():
+            lines.append(f"- {name}:")
+            lines.extend(f"    - {line}" for line in found)
+        parts.append("\n".join(lines))
+
+    header = "\n\n".join(parts)
+    header = truncate_to_budget(header, budget // 2)
+    remaining = budget - count_tokens(header) - 10
+
+    excerpts = ["## Relevant Sections"]
+    for title, body in rank_sections(sections, query, focus):
+        if remaining <= 50:
+            break
+        chunk = truncate_to_budget(f"### {title}\n{body}", min(remaining, budget // 4))
+        excerpts.append(chunk)
+        remaining -= count_tokens(chunk)
+
+    return header + "\n\n" + "\n\n".join(excerpts)
+
+
+def compact_report(text: str, budget: int = None) -> str:
+    """
+    Shrink a prior task's report to `budget` tokens, keeping its structure and figures.
+    Headings, table rows, bullets and lines with numbers survive; plain prose goes first.
+    """
+    budget = budget or TASK_TOKEN_BUDGETS["context"]
+    if count_tokens(text) <= budget:
+        return text
+
+    lines = text.splitlines()
+    essential = [
+        i for i, line in enumerate(lines)
+        if line.lstrip().startswith(("#", "|", "-", "*", "•"))
+        or re.match(r"\s*\d+[.)]\s", line)
+        or _NUMBER.search(line)
+    ]
+    keep = {i: lines[i] for i in essential}
+    compacted = "\n".join(keep[i] for i in sorted(keep))
+    used = count_tokens(compacted)
+    if used < budget:
+        # Room left: re-admit prose lines in document order, cutting the first one that overflows
+        for i, line in enumerate(lines):
+            if i in keep:
+                continue
+            cost = count_tokens(line + "\n")
+            if used + cost > budget:
+                partial = _cut_line(line, budget - used - 1)
+                if partial:
+                    keep[i] = partial
+                break
+            keep[i] = line
+            used += cost
+        compacted = "\n".join(keep[i] for i in sorted(keep))
+    return truncate_to_budget(compacted, budget)
+
+
+def compact_context_guardrail(output):
+    """
+    Task guardrail that compacts a report before it is handed to downstream tasks
+    through `context=`. Always passes; only rewrites oversized output.
+    """
+    return True, compact_report(output.raw)
@@ -5,7 +5,7 @@ Bonus feature: persistent storage of all analysis jobs and results.
 
 import os
 import datetime
-from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -32,6 +32,8 @@ class AnalysisJob(Base):
     status = Column(String(20), default="pending")                  # pending | processing | completed | failed
     result = Column(Text, nullable=True)                            # Full analysis result text
     error = Column(Text, nullable=True)                             # Error message if failed
+    document_sha256 = Column(String(64), nullable=True, index=True) # StoredDocument this job references
+    parent_job_id = Column(String(36), nullable=True)               # Job a follow-up query was asked against
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
 
@@ -39,6 +41,34 @@ class AnalysisJob(Base):
         return f"<AnalysisJob id={self.id} status={self.status}>"
 
 
+class StoredDocument(Base):
+    """A content-addressed upload in the blob store, reference-counted across jobs."""
+    __tablename__ = "stored_documents"
+
+    sha256 = Column(String(64), primary_key=True)                   # Content hash == blob key
+    filename = Column(String(255), nullable=True)                   # Name of the first upload
+    size = Column(Integer, nullable=True)                            # Bytes
+    ref_count = Column(Integer, default=0, nullable=False)          # Jobs currently referencing it
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.datetime.utcnow)  # Last acquire/release; GC grace starts here
+
+    def __repr__(self):
+        return f"<StoredDocument sha256={self.sha256[:12]} refs={self.ref_count}>"
+
+
 def init_db():
     """Create all database tables."""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+
+def _add_missing_columns():
+    """create_all() does not alter existing tables; add columns introduced after first deploy."""
+    existing = {c["name"] for c in inspect(engine).get_columns(AnalysisJob.__tablename__)}
+    with engine.begin() as conn:
+        for column in AnalysisJob.__table__.columns:
+            if column.name not in existing:
+                conn.execute(text(
+                    f"ALTER TABLE {AnalysisJob.__tablename__} "
+                    f"ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                ))
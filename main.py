@@ -1,7 +1,6 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-import os
 import uuid
 import datetime
 
@@ -16,11 +15,22 @@ from task import (
     verification,
     investment_analysis,
     risk_assessment,
+    FOLLOWUP_STAGES,
+    select_followup_stages,
 )
 
 # Bonus: Database and Queue imports
-from database import SessionLocal, AnalysisJob, init_db
+from database import SessionLocal, AnalysisJob, StoredDocument, init_db
 from worker import celery_app, run_crew_task
+from storage import (
+    get_store,
+    store_document,
+    acquire_document,
+    release_document,
+    start_garbage_collector,
+)
+from artifacts import ensure_artifacts, load_artifacts, save_artifacts, save_run_artifacts
+from compaction import digest_from_sections
 
 app = FastAPI(
     title="Financial Document Analyzer",
@@ -40,6 +50,8 @@ app.add_middleware(
 @app.on_event("startup")
 def startup_event():
     init_db()
+    # Deletes stored uploads no job references any more (after a grace period)
+    start_garbage_collector()
 
 
 # Dependency: get DB session
@@ -51,10 +63,30 @@ def get_db():
         db.close()
 
 
+async def acquire_upload(db: Session, file: UploadFile, document_id: str):
+    """
+    Store a new upload, or take a reference on a previously uploaded document.
+    Returns (document_sha256, filename); the caller owns one reference on the document.
+    """
+    if file is not None:
+        content = await file.read()
+        try:
+            return store_document(db, content, file.filename), file.filename
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error storing financial document: {str(e)}"
+            )
+    if document_id:
+        if not acquire_document(db, document_id):
+            raise HTTPException(status_code=404, detail=f"Document {document_id} not found")
+        return document_id, db.get(StoredDocument, document_id).filename
+    raise HTTPException(status_code=400, detail="Provide either a file or a document_id")
+
+
 # FIX: run_crew used 'analyze_financial_document' as both the import alias AND the FastAPI endpoint
 #      function name, causing a NameError. Renamed import alias to doc_analysis_task above.
-def run_crew(query: str, file_path: str = "data/sample.pdf") -> str:
-    """Run the full multi-agent crew synchronously."""
+def run_crew(query: str, file_path: str = "data/sample.pdf"):
+    """Run the full multi-agent crew synchronously. Returns the CrewOutput (str() for the report)."""
     query_with_path = f"{query}\n\nDocument file path: {file_path}"
 
 
@@ -66,8 +98,7 @@ def run_crew(query: str, file_path: str = "data/sample.pdf") -> str:
         process=Process.sequential,
         verbose=True,
     )
-    result = financial_crew.kickoff({"query": query_with_path})
-    return str(result)
+    return financial_crew.kickoff({"query": query_with_path})
 
 
 # @app.get("/")
@@ -103,37 +134,39 @@ async def root():
 
 @app.post("/analyze")
 async def analyze_document_sync(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
     query: str = Form(default="Analyze this financial document for investment insights"),
+    document_id: str = Form(default=None),
     db: Session = Depends(get_db),
 ):
     """
     Upload a financial document and receive an analysis synchronously in the response.
+    Pass `document_id` from an earlier response instead of `file` to re-analyze without re-uploading.
     """
     file_id = str(uuid.uuid4())
-    file_path = f"data/financial_document_{file_id}.pdf"
-
-    try:
-        os.makedirs("data", exist_ok=True)
 
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+    # FIX: was 'if query == "" or query is None' — None check must come first to avoid
+    #      AttributeError when query is None (short-circuit doesn't help with ==)
+    if not query or not query.strip():
+        query = "Analyze this financial document for investment insights"
 
-        # FIX: was 'if query == "" or query is None' — None check must come first to avoid
-        #      AttributeError when query is None (short-circuit doesn't help with ==)
-        if not query or not query.strip():
-            query = "Analyze this financial document for investment insights"
+    document_sha256, filename = await acquire_upload(db, file, document_id)
 
-        result = run_crew(query=query.strip(), file_path=file_path)
+    try:
+        with get_store().local_path(document_sha256) as file_path:
+            crew_output = run_crew(query=query.strip(), file_path=file_path)
+            # Keep parsed text, metrics and verification for follow-up queries
+            save_run_artifacts(document_sha256, file_path, crew_output)
+        result = str(crew_output)
 
-        # Store result in DB
+        # Store result in DB; the job keeps its reference on the document until deleted
         job = AnalysisJob(
             id=file_id,
-            filename=file.filename,
+            filename=filename,
             query=query.strip(),
             status="completed",
             result=result,
+            document_sha256=document_sha256,
             created_at=datetime.datetime.utcnow(),
             completed_at=datetime.datetime.utcnow(),
         )
@@ -143,74 +176,208 @@ async def analyze_document_sync(
         return {
             "status": "success",
             "job_id": file_id,
+            "document_id": document_sha256,
             "query": query,
             "analysis": result,
-            "file_processed": file.filename,
+            "file_processed": filename,
         }
 
     except Exception as e:
+        db.rollback()
+        release_document(db, document_sha256)
         raise HTTPException(
             status_code=500, detail=f"Error processing financial document: {str(e)}"
         )
 
-    finally:
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
-
 # Bonus 1
 # ── ASYNC / QUEUE ENDPOINT (Bonus: Celery + Redis) ────────────────────────────
 
 @app.post("/analyze/async")
 async def analyze_document_async(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
     query: str = Form(default="Analyze this financial document for investment insights"),
+    document_id: str = Form(default=None),
     db: Session = Depends(get_db),
 ):
     """
     Submit a financial document for asynchronous analysis via Celery queue.
     Returns a job_id immediately; poll /jobs/{job_id} for results.
+    Pass `document_id` instead of `file` to re-analyze a stored document.
     """
     file_id = str(uuid.uuid4())
-    file_path = f"data/financial_document_{file_id}.pdf"
-
-    os.makedirs("data", exist_ok=True)
-
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
 
     if not query or not query.strip():
         query = "Analyze this financial document for investment insights"
 
+    # Workers fetch the document from shared storage, so they can run on other nodes
+    document_sha256, filename = await acquire_upload(db, file, document_id)
+
     # Store pending job in DB
     job = AnalysisJob(
         id=file_id,
-        filename=file.filename,
+        filename=filename,
         query=query.strip(),
         status="pending",
         result=None,
+        document_sha256=document_sha256,
         created_at=datetime.datetime.utcnow(),
         completed_at=None,
     )
-    db.add(job)
-    db.commit()
+    try:
+        db.add(job)
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_document(db, document_sha256)
+        raise
 
     # Dispatch to Celery worker
-    run_crew_task.apply_async(
-        args=[file_id, query.strip(), file_path],
-        task_id=file_id,
-    )
+    try:
+        run_crew_task.apply_async(
+            args=[file_id, query.strip(), document_sha256],
+            task_id=file_id,
+        )
+    except Exception as e:
+        # e.g. broker unreachable: don't leave a forever-pending job holding the document
+        job.status = "failed"
+        job.error = f"Could not queue analysis: {str(e)}"
+        job.completed_at = datetime.datetime.utcnow()
+        # The job no longer holds a reference, so DELETE /jobs must not release one again
+        job.document_sha256 = None
+        release_document(db, document_sha256, commit=False)
+        db.commit()
+        raise HTTPException(
+            status_code=503, detail=f"Could not queue analysis job: {str(e)}"
+        )
 
     return {
         "status": "queued",
         "job_id": file_id,
+        "document_id": document_sha256,
         "message": "Analysis queued. Poll /jobs/{job_id} for results.",
         "poll_url": f"/jobs/{file_id}",
     }
 
+# ── FOLLOW-UP QUERY ENDPOINT ──────────────────────────────────────────────────
+
+@app.post("/jobs/{job_id}/query")
+async def query_existing_document(
+    job_id: str,
+    query: str = Form(...),
+    db: Session = Depends(get_db),
+):
+    """
+    Ask a follow-up question about a previously analyzed document without re-uploading it.
+    Reuses the stored parsed sections, extracted metrics and verification result, and runs
+    only the analysis stages the query needs.
+    """
+    if not query or not query.strip():
+        raise HTTPException(status_code=400, detail="query must not be empty")
+    query = query.strip()
+
+    parent = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+    if not parent:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if parent.status != "completed":
+        raise HTTPException(
+            status_code=409, detail=f"Job {job_id} is {parent.status}; follow-ups need a completed analysis"
+        )
+    if not parent.document_sha256:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has no stored document; re-upload it")
+    if not acquire_document(db, parent.document_sha256):
+        raise HTTPException(status_code=404, detail=f"Document for job {job_id} is no longer stored")
+
+    file_id = str(uuid.uuid4())
+    stages = select_followup_stages(query)
+    stages_run = []
+    try:
+        # Stored artifacts answer most follow-ups; only fetch the document (an S3 download on
+        # that backend) when they or the verification result are missing
+        artifacts = load_artifacts(parent.document_sha256)
+        verification_result = artifacts.get("verification") if artifacts else None
+        if not verification_result:
+            with get_store().local_path(parent.document_sha256) as file_path:
+                if artifacts is None:
+                    artifacts = ensure_artifacts(parent.document_sha256, file_path)
+                # No recorded verification (e.g. artifacts saved by an older run): verify now
+                # rather than tell the agents the document was verified, and keep the result
+                verification_crew = Crew(
+                    agents=[verifier],
+                    tasks=[verification],
+                    process=Process.sequential,
+                    verbose=True,
+                )
+                verification_output = verification_crew.kickoff(
+                    {"query": f"{query}\n\nDocument file path: {file_path}"}
+                )
+                verification_result = verification_output.tasks_output[0].raw
+                artifacts["verification"] = verification_result
+                save_artifacts(parent.document_sha256, artifacts)
+                stages_run.append("verification")
+
+        if "NOT A FINANCIAL DOCUMENT" in verification_result.upper():
+            raise HTTPException(status_code=422, detail="Document failed verification; no follow-up analysis")
+
+        focus = stages[0] if len(stages) == 1 and stages[0] != "analysis" else "general"
+        digest = digest_from_sections(artifacts["sections"], artifacts["metrics"], query=query, focus=focus)
+        tasks = [FOLLOWUP_STAGES[name][0] for name in stages]
+
+        followup_crew = Crew(
+            agents=[task.agent for task in tasks],
+            tasks=tasks,
+            process=Process.sequential,
+            verbose=True,
+        )
+        crew_output = followup_crew.kickoff({
+            "query": query,
+            "verification": verification_result,
+            "document_digest": digest,
+        })
+        stages_run.extend(stages)
+
+        # Every stage's answer, not just the last task's (which is all str(crew_output) holds)
+        if len(stages) == 1:
+            result = str(crew_output)
+        else:
+            result = "\n\n".join(
+                f"# {FOLLOWUP_STAGES[name][1]}\n\n{output.raw}"
+                for name, output in zip(stages, crew_output.tasks_output)
+            )
+
+        job = AnalysisJob(
+            id=file_id,
+            filename=parent.filename,
+            query=query,
+            status="completed",
+            result=result,
+            document_sha256=parent.document_sha256,
+            parent_job_id=parent.id,
+            created_at=datetime.datetime.utcnow(),
+            completed_at=datetime.datetime.utcnow(),
+        )
+        db.add(job)
+        db.commit()
+
+        return {
+            "status": "success",
+            "job_id": file_id,
+            "parent_job_id": parent.id,
+            "document_id": parent.document_sha256,
+            "query": query,
+            "stages_run": stages_run,
+            "analysis": result,
+        }
+
+    except HTTPException:
+        release_document(db, parent.document_sha256)
+        raise
+    except Exception as e:
+        db.rollback()
+        release_document(db, parent.document_sha256)
+        raise HTTPException(
+            status_code=500, detail=f"Error answering follow-up query: {str(e)}"
+        )
+
 # Bonus 2
 # ── JOB STATUS ENDPOINTS (Bonus: Database Integration) ────────────────────────
 
@@ -224,6 +391,8 @@ async def get_job_status(job_id: str, db: Session = Depends(get_db)):
     return {
         "job_id": job.id,
         "filename": job.filename,
+        "document_id": job.document_sha256,
+        "parent_job_id": job.parent_job_id,
         "query": job.query,
         "status": job.status,
         "analysis": job.result,
@@ -272,6 +441,8 @@ async def delete_job(job_id: str, db: Session = Depends(get_db)):
     job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    # The stored document is garbage-collected once no job references it
+    release_document(db, job.document_sha256, commit=False)
     db.delete(job)
     db.commit()
     return {"message": f"Job {job_id} deleted successfully"}
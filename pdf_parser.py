@@ -0,0 +1,147 @@
+"""
+pdf_parser.py — Multi-process PDF text extraction for large financial filings.
+
+Page ranges are split across a process pool and merged back in page order.
+Small documents are parsed serially, where pool start-up would cost more than it saves.
+
+Configurable via env vars:
+    PDF_PARSE_WORKERS       worker processes (default: CPU count)
+    PDF_PARALLEL_MIN_PAGES  page count below which parsing stays serial (default: 64)
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+# Ranges per worker; >1 evens out pages that take longer to extract (tables, scans)
+CHUNKS_PER_WORKER = 4
+
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _clean(content: str) -> str:
+    # Remove extra blank lines, same cleaning the reader tool has always applied
+    while "\n\n" in content:
+        content = content.replace("\n\n", "\n")
+    return content
+
+
+def _parse_range(path: str, start: int, stop: int) -> list:
+    """Extract cleaned text for pages [start, stop). Runs inside pool workers."""
+    reader = PdfReader(path)
+    return [_clean(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+
+def page_ranges(page_count: int, workers: int) -> list:
+    """Split `page_count` pages into contiguous [start, stop) ranges for `workers` processes."""
+    chunks = max(1, min(page_count, workers * CHUNKS_PER_WORKER))
+    size, extra = divmod(page_count, chunks)
+    ranges, start = [], 0
+    for i in range(chunks):
+        stop = start + size + (1 if i < extra else 0)
+        if stop > start:
+            ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    # Pools are reused across documents so each request does not pay process start-up
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # Not fork: the API process already runs threads (storage GC, server, samplers)
+            # and forking a multi-threaded process can deadlock children on inherited locks
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT)
+        return pool
+
+
+def parse_pages(path: str, workers: int = None, min_pages: int = None) -> list:
+    """Return the cleaned text of every page of `path`, in page order."""
+    workers = workers or PARSE_WORKERS
+    min_pages = PARALLEL_MIN_PAGES if min_pages is None else min_pages
+
+    page_count = len(PdfReader(path).pages)
+    if workers <= 1 or page_count < max(min_pages, 2):
+        return _parse_range(path, 0, page_count)
+
+    if multiprocessing.current_process().daemon:
+        # e.g. Celery prefork children: daemonic processes cannot start their own pool
+        return _parse_range(path, 0, page_count)
+
+    ranges = page_ranges(page_count, workers)
+    for attempt in range(2):
+        pool = None
+        try:
+            pool = _get_pool(workers)
+            futures = [pool.submit(_parse_range, path, start, stop) for start, stop in ranges]
+            break
+        # BrokenProcessPool subclasses RuntimeError, so it must be caught first
+        except (BrokenProcessPool, AssertionError, OSError) as exc:
+            logger.warning("Could not start PDF parsing pool (%s); parsing serially", exc)
+            _discard_pool(workers, pool)
+            return _parse_range(path, 0, page_count)
+        except RuntimeError as exc:
+            # Another thread shut this pool down after a breakage; retry once with a fresh one
+            if attempt == 0:
+                _discard_pool(workers, pool)
+                continue
+            logger.warning("Could not submit to PDF parsing pool (%s); parsing serially", exc)
+            return _parse_range(path, 0, page_count)
+
+    pages = []
+    try:
+        for future in futures:  # submission order == page order
+            pages.extend(future.result())
+    except BrokenProcessPool as exc:
+        # A worker died (OOM, segfault); extraction errors are not caught and propagate as-is
+        logger.warning("PDF parsing pool broke (%s); parsing serially", exc)
+        _discard_pool(workers, pool)
+        return _parse_range(path, 0, page_count)
+    return pages
+
+
+def _discard_pool(workers: int, pool: ProcessPoolExecutor = None):
+    """
+    Forget a broken pool so the next document starts a fresh one. With `pool` given, only
+    that instance is dropped, never a replacement another thread has already created.
+    """
+    with _pools_lock:
+        current = _pools.get(workers)
+        if current is None or (pool is not None and current is not pool):
+            return
+        del _pools[workers]
+    # No cancel_futures: other requests may still be collecting results from it
+    current.shutdown(wait=False)
+
+
+@lru_cache(maxsize=8)
+def _parse_cached(path: str, mtime_ns: int, size: int, workers: int) -> str:
+    return "".join(page + "\n" for page in parse_pages(path, workers=workers))
+
+
+def parse_pdf(path: str, workers: int = None, use_cache: bool = True) -> str:
+    """
+    Full cleaned text of a pdf, pages joined in order.
+    Repeat reads of an unchanged file (several tasks read the same upload) hit an in-process cache.
+    """
+    workers = workers or PARSE_WORKERS
+    if not use_cache:
+        return "".join(page + "\n" for page in parse_pages(path, workers=workers))
+    stat = os.stat(path)
+    return _parse_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, workers)
@@ -0,0 +1,278 @@
+"""
+storage.py — Shared, content-addressed upload storage with reference counting.
+
+Uploads are stored once under their SHA-256, so the API and Celery workers can run
+on different nodes and the same document can be re-analyzed without re-uploading.
+Every job holds a reference on its document; blobs whose references have all been
+released are deleted by a background garbage collector after a grace period.
+
+Backends (STORAGE_BACKEND env var):
+    local  files under STORAGE_ROOT (default: data/blobs) — shared volume / single node
+    s3     S3-compatible bucket (AWS S3, MinIO, ...) via S3_BUCKET / S3_ENDPOINT_URL
+"""
+
+import os
+import hashlib
+import logging
+import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, StoredDocument
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "data/blobs")
+S3_BUCKET = os.getenv("S3_BUCKET", "financial-documents")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_PREFIX = os.getenv("S3_PREFIX", "blobs/")
+GC_INTERVAL_SECONDS = int(os.getenv("STORAGE_GC_INTERVAL", "600"))
+GC_GRACE_SECONDS = int(os.getenv("STORAGE_GC_GRACE_SECONDS", "3600"))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def artifact_key(sha256: str) -> str:
+    """Blob key for a document's derived artifacts (see artifacts.py); lives and dies with it."""
+    return f"{sha256}.artifacts"
+
+
+# ── BACKENDS ──────────────────────────────────────────────────────────────────
+
+class LocalBlobStore:
+    """Blobs as files under `root`, fanned out by hash prefix."""
+
+    def __init__(self, root: str = STORAGE_ROOT):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def local_path(self, key: str):
+        """Yield a filesystem path to the blob (the blob itself; nothing to clean up)."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Blob {key} not found")
+        yield path
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3-compatible bucket."""
+
+    def __init__(self, bucket: str = S3_BUCKET, endpoint_url: str = S3_ENDPOINT_URL, prefix: str = S3_PREFIX):
+        try:
+            import boto3
+        except ImportError as exc:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)") from exc
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    @contextmanager
+    def local_path(self, key: str):
+        """Download the blob to a temporary file for the duration of the block."""
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self.client.download_fileobj(self.bucket, self._key(key), f)
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+_store = None
+
+
+def get_store():
+    """Process-wide blob store for the configured backend."""
+    global _store
+    if _store is None:
+        if STORAGE_BACKEND == "s3":
+            _store = S3BlobStore()
+        elif STORAGE_BACKEND == "local":
+            _store = LocalBlobStore()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'local' or 's3')")
+    return _store
+
+
+# ── REFERENCE COUNTING ────────────────────────────────────────────────────────
+
+def _increment(db, sha256: str) -> bool:
+    updated = (
+        db.query(StoredDocument)
+        .filter(StoredDocument.sha256 == sha256)
+        .update(
+            {
+                StoredDocument.ref_count: StoredDocument.ref_count + 1,
+                StoredDocument.last_used_at: datetime.datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return updated == 1
+
+
+def store_document(db, data: bytes, filename: str = None) -> str:
+    """
+    Store an upload and take one reference on it. Returns the document's SHA-256.
+    The reference is committed before the blob is written, so a concurrent garbage
+    collection pass (which deletes under the same row lock) can never remove it.
+    """
+    sha256 = content_hash(data)
+    if not _increment(db, sha256):
+        try:
+            db.add(StoredDocument(
+                sha256=sha256,
+                filename=filename,
+                size=len(data),
+                ref_count=1,
+                created_at=datetime.datetime.utcnow(),
+                last_used_at=datetime.datetime.utcnow(),
+            ))
+            db.commit()
+        except IntegrityError:
+            # Another request stored the same content first
+            db.rollback()
+            _increment(db, sha256)
+
+    store = get_store()
+    try:
+        if not store.exists(sha256):
+            store.put(sha256, data)
+    except Exception:
+        # Don't leave a reference pointing at a blob that was never written
+        release_document(db, sha256)
+        raise
+    return sha256
+
+
+def acquire_document(db, sha256: str) -> bool:
+    """Take a reference on an already stored document. False if it no longer exists."""
+    if not _increment(db, sha256):
+        return False
+    if not get_store().exists(sha256):
+        release_document(db, sha256)
+        return False
+    return True
+
+
+def release_document(db, sha256: str, commit: bool = True):
+    """
+    Drop one reference. The blob is only deleted later, by garbage collection.
+    Pass commit=False to make the release part of the caller's transaction.
+    """
+    if not sha256:
+        return
+    db.query(StoredDocument).filter(
+        StoredDocument.sha256 == sha256, StoredDocument.ref_count > 0
+    ).update(
+        {
+            StoredDocument.ref_count: StoredDocument.ref_count - 1,
+            StoredDocument.last_used_at: datetime.datetime.utcnow(),
+        },
+        synchronize_session=False,
+    )
+    if commit:
+        db.commit()
+
+
+def collect_garbage(grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    """Delete documents unreferenced for longer than `grace_seconds`. Returns the number deleted."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace_seconds)
+    store = get_store()
+    db = SessionLocal()
+    deleted = 0
+    try:
+        candidates = [
+            row.sha256 for row in
+            db.query(StoredDocument.sha256)
+            .filter(StoredDocument.ref_count <= 0, StoredDocument.last_used_at < cutoff)
+            .all()
+        ]
+        for sha256 in candidates:
+            # Conditional delete: skipped if a new reference was taken since the scan.
+            # The row lock is held until commit, so store_document() waits for the blob delete.
+            removed = db.query(StoredDocument).filter(
+                StoredDocument.sha256 == sha256, StoredDocument.ref_count <= 0
+            ).delete(synchronize_session=False)
+            if removed:
+                store.delete(artifact_key(sha256))
+                store.delete(sha256)
+                deleted += 1
+            db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Storage garbage collection failed")
+    finally:
+        db.close()
+    return deleted
+
+
+def start_garbage_collector(interval_seconds: int = GC_INTERVAL_SECONDS) -> threading.Thread:
+    """Run collect_garbage() every `interval_seconds` on a daemon thread (0 disables)."""
+    if interval_seconds <= 0:
+        return None
+    stop = threading.Event()
+
+    def _loop():
+        while not stop.wait(interval_seconds):
+            deleted = collect_garbage()
+            if deleted:
+                logger.info("Storage GC removed %d unreferenced document(s)", deleted)
+
+    thread = threading.Thread(target=_loop, name="storage-gc", daemon=True)
+    thread.stop = stop
+    thread.start()
+    return thread
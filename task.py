@@ -1,8 +1,11 @@
 ## Importing libraries and files
+import re
+
 from crewai import Task
 
 from agents import financial_analyst, verifier, investment_advisor, risk_assessor
 from tools import search_tool, FinancialDocumentTool
+from compaction import compact_context_guardrail
 
 ## Task 1: Verify the uploaded document is a valid financial report
 # FIX: description encouraged hallucinating financial terms — replaced with real verification task
@@ -65,6 +68,8 @@ analyze_financial_document = Task(
     async_execution=False,
     # FIX: Task now correctly references prior verification context
     context=[verification],
+    # Downstream tasks get this report through context=; cap its size so their prompts stay bounded
+    guardrail=compact_context_guardrail,
 )
 
 ## Task 3: Investment considerations
@@ -73,7 +78,9 @@ analyze_financial_document = Task(
 investment_analysis = Task(
     description=(
         "Extract the document file path from the query if provided in format 'Document file path: <path>'. "
-        "Use that path with the Financial Document Reader tool to read the document first.\n\n"
+        "Use that path with the Financial Document Digest tool (focus='investment', query=the user query) "
+        "to get the document's section index, key metrics and relevant sections. Do not read the full "
+        "document; the prior financial analysis is already provided as context.\n\n"
         "User query: {query}\n\n"
         "Based on the financial analysis, provide balanced investment considerations for: {query}\n\n"
         "Address:\n"
@@ -94,7 +101,8 @@ investment_analysis = Task(
         "No fabricated data, no non-existent URLs, no guaranteed return claims."
     ),
     agent=investment_advisor,
-    tools=[FinancialDocumentTool.read_data_tool],
+    # Token-budgeted digest instead of the raw document
+    tools=[FinancialDocumentTool.read_digest_tool],
     async_execution=False,
     context=[analyze_financial_document],
 )
@@ -105,7 +113,9 @@ investment_analysis = Task(
 risk_assessment = Task(
     description=(
         "Extract the document file path from the query if provided in format 'Document file path: <path>'. "
-        "Use that path with the Financial Document Reader tool to read the document first.\n\n"
+        "Use that path with the Financial Document Digest tool (focus='risk', query=the user query) "
+        "to get the document's section index, key metrics and relevant sections. Do not read the full "
+        "document; the prior financial analysis is already provided as context.\n\n"
         "User query: {query}\n\n"
         "Using the financial document, produce a structured risk assessment addressing: {query}\n\n"
         "Identify and evaluate:\n"
@@ -125,7 +135,117 @@ risk_assessment = Task(
         "All risks must reference specific disclosures or data points from the document."
     ),
     agent=risk_assessor,
-    tools=[FinancialDocumentTool.read_data_tool],
+    tools=[FinancialDocumentTool.read_digest_tool],
     async_execution=False,
     context=[analyze_financial_document],
 )
+
+
+## Follow-up tasks: re-query an already analyzed document
+# These reuse the stored verification result and a digest built from the stored parsed text
+# ({verification}, {document_digest}), so they neither re-verify nor re-read the document.
+_FOLLOWUP_PREAMBLE = (
+    "This is a follow-up question about a document that has already been verified and parsed. "
+    "Do not re-verify it and do not try to read the file.\n\n"
+    "Prior verification result:\n{verification}\n\n"
+    "Document digest (section index, extracted metrics, relevant sections):\n{document_digest}\n\n"
+    "Follow-up query: {query}\n\n"
+)
+
+followup_analysis = Task(
+    description=(
+        _FOLLOWUP_PREAMBLE
+        + "Answer the follow-up query with a focused financial analysis. Cite the specific figures "
+        "from the digest that support each point, and state clearly when the digest does not "
+        "contain the data needed to answer."
+    ),
+    expected_output=(
+        "A focused financial analysis answering the follow-up query:\n"
+        "- Direct Answer (2-4 sentences)\n"
+        "- Supporting Metrics with figures from the document\n"
+        "- Key Takeaways\n"
+        "All figures cited with their source in the document."
+    ),
+    agent=financial_analyst,
+    # Market context only; the document itself comes from the digest
+    tools=[search_tool],
+    async_execution=False,
+)
+
+followup_investment = Task(
+    description=(
+        _FOLLOWUP_PREAMBLE
+        + "Provide balanced investment considerations focused on the follow-up query: bull case, "
+        "bear case and catalysts grounded in the digest. Include the standard disclaimer that this "
+        "is not personalized financial advice."
+    ),
+    expected_output=(
+        "A focused investment considerations report with:\n"
+        "- Bull Case and Bear Case relevant to the query (evidence-based)\n"
+        "- Key Catalysts to Monitor\n"
+        "- Standard Investment Disclaimer"
+    ),
+    agent=investment_advisor,
+    async_execution=False,
+)
+
+followup_risk = Task(
+    description=(
+        _FOLLOWUP_PREAMBLE
+        + "Assess the risks relevant to the follow-up query using the disclosures and figures in "
+        "the digest. For each risk, assess Likelihood (High/Medium/Low) and Potential Impact "
+        "(High/Medium/Low)."
+    ),
+    expected_output=(
+        "A focused risk assessment containing:\n"
+        "- Risk Matrix table (Risk | Category | Likelihood | Impact | Mitigation Noted in Report)\n"
+        "- Most critical risk for the query with a detailed explanation"
+    ),
+    agent=risk_assessor,
+    async_execution=False,
+)
+
+# Follow-up stage -> (task, report heading, whole words (optional plural "s"), word prefixes).
+# Whole-word matching keeps "sell" out of "selling, general and administrative" and "eps" out
+# of "steps".
+FOLLOWUP_STAGES = {
+    "analysis": (followup_analysis, "Financial Analysis", [
+        "revenue", "income", "margin", "cash flow", "earning", "eps", "profit", "balance sheet",
+        "liquidity", "metric", "guidance", "trend", "expense", "cost",
+    ], ["profitab"]),
+    "investment": (followup_investment, "Investment Considerations", [
+        "buy", "sell", "valuation", "bull", "bullish", "bear", "bearish", "upside", "catalyst",
+        "growth", "stock", "share price",
+    ], ["invest", "opportunit", "recommend"]),
+    "risk": (followup_risk, "Risk Assessment", [
+        "risk", "risky", "debt", "leverage", "exposure", "downside", "covenant", "threat",
+        "litigation",
+    ], ["regulat", "volatil", "uncertain", "hedg"]),
+}
+
+
+def _stage_pattern(words: list, prefixes: list):
+    alternatives = [r"\b(?:%s)s?\b" % "|".join(re.escape(w) for w in words)]
+    if prefixes:
+        alternatives.append(r"\b(?:%s)\w*" % "|".join(re.escape(p) for p in prefixes))
+    return re.compile("|".join(alternatives), re.I)
+
+
+_STAGE_PATTERNS = {
+    name: _stage_pattern(words, prefixes)
+    for name, (_, _, words, prefixes) in FOLLOWUP_STAGES.items()
+}
+
+
+# The endpoints' default query, and its generic "investment insights" phrase, ask for nothing
+# in particular; they are removed before matching so they don't select the investment stage
+_GENERIC_QUERY = re.compile(
+    r"(?:analy[sz]e this financial document for )?investment insights?", re.I
+)
+
+
+def select_followup_stages(query: str) -> list:
+    """Stages a follow-up query needs, in pipeline order. Defaults to analysis only."""
+    query = _GENERIC_QUERY.sub(" ", query)
+    stages = [name for name, pattern in _STAGE_PATTERNS.items() if pattern.search(query)]
+    return stages or ["analysis"]
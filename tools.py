@@ -5,11 +5,11 @@ load_dotenv()
 
 # FIX: Was importing 'tools' (the module itself) instead of specific tool classes
 from crewai_tools import SerperDevTool
-# FIX: Was importing from wrong subpath; SerperDevTool lives directly in crewai_tools
-from langchain_community.document_loaders import PyPDFLoader
-
 from crewai.tools import tool
 
+from compaction import build_digest, count_tokens, TASK_TOKEN_BUDGETS
+from pdf_parser import parse_pdf
+
 ## Creating search tool
 search_tool = SerperDevTool()
 
@@ -19,30 +19,45 @@ class FinancialDocumentTool():
     @staticmethod
     # added @tool
     @tool("Financial Document Reader")
-    def read_data_tool(path: str = 'data/sample.pdf') -> str:
-        """Tool to read data from a pdf file from a path
+    def read_data_tool(path: str = 'data/sample.pdf', query: str = '') -> str:
+        """Tool to read data from a pdf file from a path. Documents longer than the
+        general token budget are returned as a digest (section index, key metrics,
+        most relevant sections) so the prompt stays bounded.
 
         Args:
             path (str, optional): Path of the pdf file. Defaults to 'data/sample.pdf'.
+            query (str, optional): The user's analysis question, used to rank sections
+                when the document has to be digested.
 
         Returns:
-            str: Full Financial Document file
+            str: Full Financial Document file, or its digest if it exceeds the budget
         """
-        # FIX: 'Pdf' was not imported/defined; correct class is PyPDFLoader from langchain
-        docs = PyPDFLoader(file_path=path).load()
+        text = load_document_text(path)
+        if count_tokens(text) > TASK_TOKEN_BUDGETS["general"]:
+            return build_digest(text, query=query, focus="general")
+        return text
+
+    @staticmethod
+    @tool("Financial Document Digest")
+    def read_digest_tool(path: str = 'data/sample.pdf', query: str = '', focus: str = 'general') -> str:
+        """Tool to read a token-budgeted digest of a pdf file: section index,
+        extracted key metrics and the sections most relevant to the query.
 
-        full_report = ""
-        for data in docs:
-            # Clean and format the financial document data
-            content = data.page_content
+        Args:
+            path (str, optional): Path of the pdf file. Defaults to 'data/sample.pdf'.
+            query (str, optional): The user's analysis question, used to rank sections.
+            focus (str, optional): 'general', 'investment' or 'risk'. Selects the token budget.
 
-            # Remove extra whitespaces and format properly
-            while "\n\n" in content:
-                content = content.replace("\n\n", "\n")
+        Returns:
+            str: Structured digest of the financial document
+        """
+        return build_digest(load_document_text(path), query=query, focus=focus)
 
-            full_report += content + "\n"
 
-        return full_report
+def load_document_text(path: str) -> str:
+    """Parse a pdf into cleaned plain text, one page after another."""
+    # Large filings are split across a process pool; small ones are parsed serially
+    return parse_pdf(path)
 
 
 ## Creating Investment Analysis Tool
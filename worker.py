@@ -38,13 +38,17 @@ celery_app.conf.update(
     max_retries=3,
     default_retry_delay=30,
 )
-def run_crew_task(self, job_id: str, query: str, file_path: str):
+def run_crew_task(self, job_id: str, query: str, document_sha256: str):
     """
     Celery task: runs the full CrewAI financial analysis crew.
-    Updates the database with status and result when complete.
+    The document is fetched from shared storage by content hash, so the worker
+    may run on a different node from the API. Updates the database with status
+    and result when complete.
     """
     # Import inside task to avoid circular imports and ensure fresh DB session
     from database import SessionLocal, AnalysisJob
+    from storage import get_store
+    from artifacts import save_run_artifacts
     from crewai import Crew, Process
     from agents import financial_analyst, verifier, investment_advisor, risk_assessor
     from task import (
@@ -63,14 +67,17 @@ def run_crew_task(self, job_id: str, query: str, file_path: str):
             job.status = "processing"
             db.commit()
 
-        # Run the crew
+        # Run the crew against a local copy of the stored document
         financial_crew = Crew(
             agents=[verifier, financial_analyst, investment_advisor, risk_assessor],
             tasks=[verification, doc_analysis_task, investment_analysis, risk_assessment],
             process=Process.sequential,
             verbose=True,
         )
-        result = financial_crew.kickoff({"query": query})
+        with get_store().local_path(document_sha256) as file_path:
+            result = financial_crew.kickoff({"query": f"{query}\n\nDocument file path: {file_path}"})
+            # Keep parsed text, metrics and verification for follow-up queries
+            save_run_artifacts(document_sha256, file_path, result)
         result_str = str(result)
 
         # Update job with result
@@ -95,10 +102,6 @@ def run_crew_task(self, job_id: str, query: str, file_path: str):
         raise self.retry(exc=exc, countdown=2 ** self.request.retries * 30)
 
     finally:
+        # The job keeps its reference on the stored document; storage GC removes it
+        # once no job needs it, so retries and re-queries can still read it
         db.close()
-        # Clean up uploaded file
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass